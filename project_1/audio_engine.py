@@ -0,0 +1,352 @@
+"""
+--------------------------------------------------------------------------
+Audio Engine
+--------------------------------------------------------------------------
+License:   
+Copyright 2021-2024 - Yuka Aoyama
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Audio Engine
+The AudioEngine class runs audio playback in a separate process at raised priority, so slow Python work in the keypad process (I2C scanning, recording threads) cannot cause dropouts. Sample data is kept in shared memory, and the keypad process sends commands through a CommandRing, a single-producer single-consumer ring buffer in shared memory that neither side ever locks or waits on. Inside the engine, a loader thread attaches and frees the shared memory, so the audio callback only mixes arrays that are already mapped.
+
+start(self): Starts the engine process, in a newly spawned interpreter (not a fork of the keypad process).
+
+load(self, key, samples): Copies int16 samples into shared memory and assigns them to the key. Voices still playing the old samples keep them until they finish.
+
+unload(self, key): Removes the samples of the key. Voices still playing them keep them until they finish.
+
+trigger(self, key), stop(self, key), loop(self, key), stop_all(self): Start, stop or loop the sound of a key. They return False instead of waiting if the ring is full.
+
+close(self): Stops the engine process and frees the shared memory.
+
+read_wav(path): Decodes a wav file to mono int16 samples at the engine samplerate.
+
+"""
+from collections import deque
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import struct
+import threading
+import time
+import wave
+import numpy as np
+
+SAMPLERATE = 44100
+BLOCKSIZE = 256
+PRIORITY = 50  # SCHED_FIFO priority of the engine process
+LOADER_INTERVAL = 0.002  # seconds between checks for samples to attach / free
+
+RING_SLOTS = 256
+RING_HEADER = 64  # head and tail indexes, padded to a cache line
+SLOT = struct.Struct('<BB2xI32s')  # opcode, key, frames, shared memory name
+
+TRIGGER = 1
+STOP = 2
+LOOP = 3
+STOP_ALL = 4
+LOAD = 5
+UNLOAD = 6
+QUIT = 7
+
+class CommandRing:
+    def __init__(self, name=None, slots=RING_SLOTS):
+        # Create the ring, or attach to the one created by the other process
+        size = RING_HEADER + slots * SLOT.size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.slots = slots
+        # index[0] (head) is only written by the producer and index[1] (tail)
+        # only by the consumer; each is a single aligned 64-bit store
+        self.index = np.ndarray((2,), dtype=np.uint64, buffer=self.shm.buf)
+
+    def push(self, opcode, key=0, frames=0, name=b''):
+        head = int(self.index[0])
+        if head - int(self.index[1]) >= self.slots:
+            return False
+        SLOT.pack_into(self.shm.buf, RING_HEADER + (head % self.slots) * SLOT.size,
+                       opcode, key, frames, name)
+        # Publish the slot only after it has been written
+        self.index[0] = head + 1
+        return True
+
+    def pop(self):
+        tail = int(self.index[1])
+        if tail == int(self.index[0]):
+            return None
+        opcode, key, frames, name = SLOT.unpack_from(
+            self.shm.buf, RING_HEADER + (tail % self.slots) * SLOT.size)
+        self.index[1] = tail + 1
+        return opcode, key, frames, name.rstrip(b'\0').decode()
+
+    def close(self):
+        self.index = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+def raise_priority(priority):
+    # Real time scheduling needs root or CAP_SYS_NICE; fall back to nice
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except (AttributeError, OSError):
+        try:
+            os.nice(-10)
+        except OSError:
+            pass
+
+def run_engine(ring_name, priority=PRIORITY):
+    # Entry point of the engine process
+    import sounddevice as sd
+
+    raise_priority(priority)
+    ring = CommandRing(ring_name)
+    # Owned by the audio callback
+    samples = {}  # key -> [shared memory, int16 array]
+    retired = []  # replaced [shared memory, int16 array] still used by voices
+    voices = {}  # key -> [int16 array, position, looping]
+    pending = {}  # key -> loads handed to the loader and not back yet
+    deferred = []  # commands queued behind a pending load of their key
+    # Hand-off between the callback and the loader thread; deque append and
+    # popleft never block
+    requests = deque()  # ('load', key, frames, name) or ('close', entry)
+    ready = deque()  # (key, entry), entry is None if the samples were gone
+    done = threading.Event()
+
+    def loader():
+        # Attaching and closing shared memory means system calls (and the
+        # resource tracker), so they happen here instead of in the callback
+        while not done.is_set() or requests:
+            while requests:
+                request = requests.popleft()
+                if request[0] == 'close':
+                    entry = request[1]
+                    entry[1] = None
+                    entry[0].close()
+                    continue
+                _, key, frames, name = request
+                try:
+                    shm = shared_memory.SharedMemory(name=name)
+                    entry = [shm, np.ndarray((frames,), dtype=np.int16, buffer=shm.buf)]
+                except FileNotFoundError:
+                    entry = None  # replaced again before we got to it
+                ready.append((key, entry))
+            time.sleep(LOADER_INTERVAL)
+
+    def retire(key):
+        if key in samples:
+            retired.append(samples.pop(key))
+
+    def handle(opcode, key, frames, name):
+        if opcode == LOAD:
+            pending[key] = pending.get(key, 0) + 1
+            requests.append(('load', key, frames, name))
+        elif opcode == STOP_ALL:
+            voices.clear()
+            deferred[:] = [command for command in deferred if command[0] == UNLOAD]
+        elif opcode == QUIT:
+            done.set()
+        elif key in pending:
+            # Keep the order of commands behind the load of their key
+            deferred.append((opcode, key, frames, name))
+        elif opcode == UNLOAD:
+            retire(key)
+        elif opcode == TRIGGER or opcode == LOOP:
+            if key in samples:
+                voices[key] = [samples[key][1], 0, opcode == LOOP]
+        elif opcode == STOP:
+            voices.pop(key, None)
+
+    def callback(outdata, frames, time_info, status):
+        while ready:
+            key, entry = ready.popleft()
+            pending[key] -= 1
+            if pending[key] == 0:
+                del pending[key]
+            if entry is not None:
+                retire(key)
+                samples[key] = entry
+        if deferred:
+            commands = deferred[:]
+            del deferred[:]
+            for command in commands:
+                handle(*command)
+
+        command = ring.pop()
+        while command is not None:
+            handle(*command)
+            command = ring.pop()
+
+        mix = outdata[:, 0]
+        mix.fill(0)
+        for key, voice in list(voices.items()):
+            data, position, looping = voice
+            filled = 0
+            while filled < frames:
+                chunk = data[position:position + frames - filled]
+                mix[filled:filled + len(chunk)] += chunk
+                filled += len(chunk)
+                position += len(chunk)
+                if position >= len(data):
+                    if not looping or len(data) == 0:
+                        break
+                    position = 0
+            if position >= len(data) and not looping:
+                del voices[key]
+            else:
+                voice[1] = position
+        np.clip(mix * (1.0 / 32768), -1.0, 1.0, out=mix)
+
+        # Have the loader free replaced samples once no voice plays them
+        for entry in list(retired):
+            if not any(voice[0] is entry[1] for voice in voices.values()):
+                retired.remove(entry)
+                requests.append(('close', entry))
+
+    loader_thread = threading.Thread(target=loader, daemon=True)
+    loader_thread.start()
+
+    with sd.OutputStream(samplerate=SAMPLERATE, blocksize=BLOCKSIZE, channels=1,
+                         dtype='float32', callback=callback):
+        done.wait()
+
+    loader_thread.join()
+    voices.clear()
+    entries = list(samples.values()) + retired + [entry for key, entry in ready if entry is not None]
+    for entry in entries:
+        entry[1] = None
+        entry[0].close()
+    samples.clear()
+    retired.clear()
+    ready.clear()
+    ring.close()
+
+def read_wav(path):
+    # Decode a wav file to mono int16 at SAMPLERATE
+    with wave.open(path, 'rb') as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        data = (np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif width == 2:
+        data = np.frombuffer(raw, dtype='<i2')
+    elif width == 4:
+        data = (np.frombuffer(raw, dtype='<i4') >> 16).astype(np.int16)
+    else:
+        raise ValueError("Unsupported sample width {0} in {1}".format(width, path))
+
+    data = data.reshape(-1, channels).mean(axis=1)
+    if rate != SAMPLERATE and len(data):
+        positions = np.arange(0, len(data), rate / SAMPLERATE)
+        data = np.interp(positions, np.arange(len(data)), data)
+    return data.astype(np.int16)
+
+class AudioEngine:
+    def __init__(self, priority=PRIORITY):
+        self.priority = priority
+        self.ring = CommandRing()
+        self.samples = {}  # key -> shared memory owned by this process
+        self.process = None
+        # The ring has a single producer; this lock only orders pushes from
+        # threads of this process (e.g. the sound watcher and the press
+        # path) and is held just for the push, never by the engine
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.process is not None:
+            return
+        # A fresh interpreter rather than a fork: the keypad process may
+        # already have PortAudio initialised (Record imports sounddevice and
+        # measure_latency runs a stream), and a forked copy of its state is
+        # not safe to use in the engine
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(target=run_engine, args=(self.ring.name, self.priority), daemon=True)
+        self.process.start()
+
+    def load(self, key, samples):
+        samples = np.asarray(samples, dtype=np.int16).reshape(-1)
+        shm = shared_memory.SharedMemory(create=True, size=max(samples.nbytes, 1))
+        np.ndarray(samples.shape, dtype=np.int16, buffer=shm.buf)[:] = samples
+        if not self.push(LOAD, key, len(samples), shm.name.encode()):
+            shm.close()
+            shm.unlink()
+            return False
+        # The engine keeps its own mapping of the old samples until its
+        # voices are done, so the name can go away now
+        old = self.samples.pop(key, None)
+        if old is not None:
+            old.close()
+            old.unlink()
+        self.samples[key] = shm
+        return True
+
+    def unload(self, key):
+        if not self.push(UNLOAD, key):
+            return False
+        old = self.samples.pop(key, None)
+        if old is not None:
+            old.close()
+            old.unlink()
+        return True
+
+    def push(self, opcode, key=0, frames=0, name=b''):
+        with self.lock:
+            return self.ring.push(opcode, key, frames, name)
+
+    def trigger(self, key):
+        return self.push(TRIGGER, key)
+
+    def stop(self, key):
+        return self.push(STOP, key)
+
+    def loop(self, key):
+        return self.push(LOOP, key)
+
+    def stop_all(self):
+        return self.push(STOP_ALL)
+
+    def close(self):
+        if self.process is not None:
+            self.push(QUIT)
+            self.process.join(timeout=2)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        for shm in self.samples.values():
+            shm.close()
+            shm.unlink()
+        self.samples.clear()
+        self.ring.close()
+        self.ring.unlink()
@@ -0,0 +1,93 @@
+"""
+--------------------------------------------------------------------------
+Capture
+--------------------------------------------------------------------------
+License:   
+Copyright 2021-2024 - Yuka Aoyama
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Capture
+The EventLog class records every Trellis key event from Keypad.handle_press and every arcade button edge, with time.monotonic_ns() timestamps, to a compact binary log. replay.py feeds a log back through the keypad without hardware.
+
+Log format: the 8 byte MAGIC, then one 11 byte record per event: timestamp in ns (uint64), kind (KEY or BUTTON), key or button index, and value (1 = pressed, 0 = released). All fields are little endian.
+
+record(self, kind, index, value): Appends one event.
+
+watch_button(button, index, handle_button): Sends the press / release edges of a Button (python/button/button.py) to handle_button(index, pressed), keeping its existing callbacks. Keypad.handle_button records them as BUTTON events.
+
+read_log(path): Returns the list of (timestamp_ns, kind, index, value) events in a log.
+
+"""
+import struct
+import threading
+import time
+
+MAGIC = b'ENGIEVT1'
+EVENT = struct.Struct('<QBBB')
+
+KEY = 0
+BUTTON = 1
+
+class EventLog:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.lock = threading.Lock()  # button threads and the press loop both record
+
+    def record(self, kind, index, value):
+        with self.lock:
+            self.file.write(EVENT.pack(time.monotonic_ns(), kind, index, value))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def watch_button(button, index, handle_button):
+    on_press = button.on_press_callback
+    on_release = button.on_release_callback
+
+    def pressed():
+        handle_button(index, True)
+        if on_press is not None:
+            return on_press()
+
+    def released():
+        handle_button(index, False)
+        if on_release is not None:
+            return on_release()
+
+    button.set_on_press_callback(pressed)
+    button.set_on_release_callback(released)
+
+def read_log(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{0} is not an event log".format(path))
+        data = f.read()
+    usable = len(data) - len(data) % EVENT.size  # ignore a torn last record
+    return list(EVENT.iter_unpack(data[:usable]))
@@ -33,21 +33,29 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 KeyPad
 A Keypad class manages instrument sounds and user interaction. It stores instrument sounds in a dictionary. Upon startup (boot(self)), it lights all keys for a brief welcome. When a key is pressed (handle_press(self)), the class plays the corresponding instrument sound and optionally allows recording. If recording is enabled (loop value is true), the key press intervals are saved and assigned as a new instrument to the bottom left key in the sound library.
+Sounds are played by an AudioEngine running in its own process (see audio_engine.py); the keypad only sends it trigger commands.
+Files added, changed or removed in sounds/ are decoded in the background by a SoundWatcher and swapped into the key map while playing (swap_sounds(self, changes)).
+save_slices(self, recording) splits a take at its detected hits (see onset.py) and saves each hit to its own free key; run with --auto-slice to do this for every take from the record button.
+The red arcade button records a take, or overdubs a new layer while the loop plays (see Record.start_overdub); load_sound(self, key, samples) loads the loop's layers under keys above the pads.
+Run with --capture <log> to record every key and button event for replay.py.
+Recordings (save_recording(self, recording)) are assigned to the first free key and kept in a RecordingStore, which stays within a memory budget by spilling cold takes to disk.
 
 """
+import argparse
+import os
+import sys
+import threading
 import time
-import busio
-from board import SCL, SDA
-from adafruit_trellis import Trellis
 from loop import Loop
+from recording_store import RecordingStore
+from audio_engine import AudioEngine, read_wav
+from capture import EventLog, KEY, BUTTON, watch_button
+from sound_watcher import SoundWatcher
+from onset import detect_onsets, slice_take
 
 import pygame
 
-# Create the I2C interface
-i2c = busio.I2C(SCL, SDA)
-
-# Create a Trellis object for each board
-trellis = Trellis(i2c) # 0x70 when no I2C address is supplied
+SOUNDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sounds")
 
 # Dictionary to map buttons to sound files
 sound_map = {
@@ -63,49 +71,243 @@ sound_map = {
     9: "voice_1.wav",
     10: "voice_2.wav", 
 }
+NUM_KEYS = 16
+
+# Arcade button indexes for handle_button and the event log, and their pins
+RECORD_BUTTON = 0
+LOOP_BUTTON = 1
+RECORD_BUTTON_PIN = "P2_2"
+RECORD_LED_PIN = "P2_6"
+LOOP_BUTTON_PIN = "P2_4"
+
+RECORDING_BUDGET = 64 * 1024 * 1024  # bytes of takes kept in RAM
+recording_store = RecordingStore(RECORDING_BUDGET)
+
 loop_button_pin = None
 loop_variable = None
-loop_dictionary = None
-speaker = None
+loop_dictionary = {}
+speaker = None  # set to the Keypad in main, the loop instruments are keys
 loop = Loop(loop_button_pin, loop_variable, loop_dictionary, speaker)
 
 class Keypad():
     trellis = None
-    def __init__(self, trellis):
+    engine = None
+    capture = None
+    def __init__(self, trellis, engine=None, capture=None):
         self.trellis = trellis
-        pygame.init()
+        self.engine = engine  # AudioEngine process, or None to play with pygame
+        self.capture = capture  # EventLog recording every key / button event, or None
+        self.button_handlers = {}  # button index -> function(pressed)
+        self.sounds = {}  # key -> decoded pygame Sound (only without an engine)
+        self.samples = {}  # key -> decoded int16 samples, changed in place on reload (Loop mixdown)
+        if self.engine is not None:
+            # Keep exactly the takes that are in RAM loaded in the engine, so
+            # a press only sends a trigger
+            recording_store.on_resident = self.engine.load
+            recording_store.on_evict = self.engine.unload
+        if self.engine is None:
+            # Mono 16-bit so recordings can be played straight from the store
+            pygame.mixer.pre_init(44100, -16, 1)
+            pygame.init()
     
     def boot(self):
         # Light up all LEDs on boot
         self.trellis.led.fill(True)
+        # Decode once up front so a press never decodes
+        self.swap_sounds({sound_file: read_wav(os.path.join(SOUNDS_DIR, sound_file))
+                          for sound_file in sound_map.values()})
     
     def handle_press(self):
-        # Get a list of pressed buttons
-        pressed_buttons = self.trellis.read_buttons()[0] #list[int]
+        # Get lists of pressed and released buttons
+        pressed_buttons, released_buttons = self.trellis.read_buttons() #list[int]
+        if self.capture is not None:
+            for button in pressed_buttons:
+                self.capture.record(KEY, button, 1)
+            for button in released_buttons:
+                self.capture.record(KEY, button, 0)
          # Loop through pressed buttons and play sounds
         for button in pressed_buttons:
-            if button in sound_map:
-                sound_file = sound_map[button]
-                pygame.mixer.music.load(sound_file)
-                pygame.mixer.music.play()
-        if button == loop_button_pin:
-            if self.loop_variable:
+            self.play(button)
+            if button == loop_button_pin:
+                if loop.is_looping:
+                    loop.stop_loop()
+                else:
+                    loop.start_loop()
+
+    def handle_button(self, index, pressed):
+        # Edge of an arcade button (see Record / Loop); recorded for replay
+        if self.capture is not None:
+            self.capture.record(BUTTON, index, int(pressed))
+        if index in self.button_handlers:
+            self.button_handlers[index](pressed)
+    
+    def connect_buttons(self, record, loop, auto_slice=False):
+        # Red arcade button: start / stop a take, or an overdub while the loop
+        # plays. Clear arcade button: start / stop the loop. Acts on the
+        # press edge. With auto_slice, a take is split at its hits across
+        # free keys (save_slices) instead of going to one key.
+        def record_pressed(pressed):
+            if not pressed:
+                return
+            if record.is_overdubbing:
+                record.stop_overdub()
+            elif record.is_recording:
+                record.stop_record(auto_slice=auto_slice)
+            elif not (loop.is_looping and record.start_overdub(loop)):
+                record.start_record()
+
+        def loop_pressed(pressed):
+            if not pressed:
+                return
+            if loop.is_looping:
                 loop.stop_loop()
             else:
                 loop.start_loop()
-    
+
+        self.button_handlers[RECORD_BUTTON] = record_pressed
+        self.button_handlers[LOOP_BUTTON] = loop_pressed
+
+    def play(self, button):
+        if self.engine is not None:
+            if button in recording_store:
+                # Marks the take as recently used; a spilled take is paged in
+                # and loaded into the engine by the store's on_resident hook
+                recording_store.get(button)
+            self.engine.trigger(button)
+        elif button in self.sounds:
+            self.sounds[button].play()
+        elif button in recording_store:
+            pygame.mixer.Sound(buffer=recording_store.get(button)).play()
+
+    def load_sound(self, key, samples):
+        # Assign int16 samples to a key; the Loop uses this for its reserved
+        # keys (overdub layers, mixdown)
+        if self.engine is not None:
+            self.engine.load(key, samples)
+        else:
+            self.sounds[key] = pygame.mixer.Sound(buffer=samples)
+
+    def swap_sounds(self, changes):
+        # changes: file name -> decoded int16 samples, or None if the file was
+        # removed. Called at boot and from the SoundWatcher thread.
+        keys = {sound_file: key for key, sound_file in sound_map.items()}
+        sounds = dict(self.sounds)
+        for sound_file, samples in changes.items():
+            key = keys.get(sound_file)
+            if samples is None:
+                if key is not None:
+                    del sound_map[key]
+                    sounds.pop(key, None)
+                    self.samples.pop(key, None)
+                    if self.engine is not None:
+                        self.engine.unload(key)
+                continue
+            if key is None:
+                key = self.free_key()
+                if key is None:
+                    continue  # every key is taken
+                sound_map[key] = sound_file
+            self.samples[key] = samples
+            if self.engine is not None:
+                self.engine.load(key, samples)
+            else:
+                sounds[key] = pygame.mixer.Sound(buffer=samples)
+        # A single reference swap, so a press sees either the old or new map
+        self.sounds = sounds
+
+    def free_key(self):
+        # Return the first key with no sound and no recording, or None
+        for key in range(NUM_KEYS):
+            if key not in sound_map and key not in recording_store:
+                return key
+        return None
+
     def save_recording(self, recording):
-        sound_map.add(recording)
+        key = self.free_key()
+        if key is not None:
+            recording_store.put(key, recording)
+        return key
+
+    def save_slices(self, recording):
+        # Split the take at its hits and save each hit to its own free key
+        keys = []
+        for piece in slice_take(recording, detect_onsets(recording)):
+            key = self.save_recording(piece)
+            if key is None:
+                break  # out of free keys
+            keys.append(key)
+        return keys
         
 
-# Create a Keypad instance
-keypad = Keypad(trellis)
+if __name__ == '__main__':
+    import busio
+    import board
+    import digitalio
+    from board import SCL, SDA
+    from adafruit_trellis import Trellis
+    from record import Record
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python", "button"))
+    from button import Button
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capture', help="record key / button events to this log for replay.py")
+    parser.add_argument('--auto-slice', action='store_true', help="split each take at its hits across free keys")
+    args = parser.parse_args()
+
+    # Create the I2C interface
+    i2c = busio.I2C(SCL, SDA)
+
+    # Create a Trellis object for each board
+    trellis = Trellis(i2c) # 0x70 when no I2C address is supplied
+
+    # Record button (red) with its LED, and loop button (clear)
+    record_led = digitalio.DigitalInOut(getattr(board, RECORD_LED_PIN))
+    record_led.switch_to_output()
+    record_button = Button(RECORD_BUTTON_PIN)
+    loop_button = Button(LOOP_BUTTON_PIN)
+
+    # Start the audio engine process and create a Keypad instance
+    engine = AudioEngine()
+    capture = EventLog(args.capture) if args.capture else None
+    keypad = Keypad(trellis, engine, capture)
+    record = Record(RECORD_BUTTON_PIN, record_led, keypad)
+
+    # Measure the round trip latency while idle, before the engine owns the
+    # output device
+    record.measure_latency()
+    engine.start()
+
+    # Button edges go through handle_button, so they are logged for replay
+    loop.speaker = keypad  # plays the pads and the loop's reserved keys
+    loop.samples = keypad.samples  # renders the loop's mixdown
+    keypad.connect_buttons(record, loop, args.auto_slice)
+    for index, button in ((RECORD_BUTTON, record_button), (LOOP_BUTTON, loop_button)):
+        watch_button(button, index, keypad.handle_button)
+
+        def button_thread(button=button):
+            while True:
+                button.wait_for_press()
+
+        threading.Thread(target=button_thread, daemon=True).start()
+
+    # Boot up the keypad (turn on LEDs)
+    keypad.boot()
 
-# Boot up the keypad (turn on LEDs)
-keypad.boot()
+    # Pick up changes to the sounds directory while playing
+    watcher = SoundWatcher(SOUNDS_DIR, keypad)
+    watcher.start()
 
-# Main loop to continuously check for button presses
-while True:
-    keypad.handle_press()
-    time.sleep(0.1)  # Avoid rapid button presses              
+    # Main loop to continuously check for button presses
+    try:
+        while True:
+            keypad.handle_press()
+            time.sleep(0.1)  # Avoid rapid button presses
+    finally:
+        loop.stop_loop()
+        watcher.stop()
+        if capture is not None:
+            capture.close()
+        engine.close()
+        recording_store.close()
+              
     
\ No newline at end of file
@@ -38,18 +38,179 @@ start_loop(self): This function listens for a button press. If pressed, it sets
 
 stop_loop(self): Similar to start_loop(self), it listens for a button press. When pressed, it sets the loop value to false, effectively stopping any ongoing recording.
 
+current_bar(self): Returns (index, start time, length) of the bar playing, as published by the loop thread, or None when no bar is playing. next_boundary(self, now) and bar_at(self, when) are computed from it, so overdubs snap to the bars the loop actually plays.
+
+add_layer(self, take, bars, first_bar): Adds an overdub take (see Record.start_overdub) of the given number of bars. It is loaded into the speaker once, under its own key (FIRST_LAYER_KEY and up), and triggered every time the loop comes back round to the bar the take was recorded on, starting after the bars it was recorded over.
+
+The speaker plays keys: play(key) triggers a key and load_sound(key, samples) assigns int16 samples to one (see Keypad.play / Keypad.load_sound).
+
+With samples for the instruments (Loop(..., samples), e.g. Keypad.samples), a stable pattern is rendered once into a cached bar (see mixdown.py) and played as a single sound under MIXDOWN_KEY; only the parts of the bar touched by an edit are rendered again, and the bar is loaded into the speaker only when it changed.
+
 """
-from threading import Thread
+from threading import Event, Thread
+import math
 import time
+from mixdown import MixdownCache, to_int16
+
+SAMPLERATE = 44100
+IDLE_TIME = 0.1  # seconds between checks of an empty loop pattern
+
+# Speaker keys above the 16 pads, reserved for the loop
+MIXDOWN_KEY = 16
+FIRST_LAYER_KEY = 17
+LAST_KEY = 255  # keys are one byte in the AudioEngine command ring
 
 class Loop:
-    def __init__(self, button_pin, loop_variable, loop_dictionary, speaker):
+    def __init__(self, button_pin, loop_variable, loop_dictionary, speaker, samples=None,
+                 clock=time.monotonic, threaded=True):
         self.button_pin = button_pin
         self.loop_variable = loop_variable
         self.loop_dictionary = loop_dictionary  # Dictionary containing loop instruments and timings
         self.speaker = speaker
         self.thread = None
         self.is_looping = False
+        self.layers = []  # (key, int16 take, bars, first_bar) overdubs, each a whole number of bars long
+        self.samples = samples  # instrument -> samples; enables the mixdown cache
+        self.mixdown = MixdownCache()
+        self.loaded = None  # mixdown buffer loaded under MIXDOWN_KEY
+        # Without a thread (threaded=False) the owner calls run_next() when
+        # clock() reaches next_time, e.g. replay.py on its own clock
+        self.clock = clock
+        self.threaded = threaded
+        self.stopped = Event()
+        self.bar = None  # (index, start, length) of the bar playing, set by the loop thread
+        self.bar_count = 0  # index of the next bar
+        self.bar_end = None  # clock time the current bar (or idle check) ends
+        self.steps = []  # (time, instrument) still to play in the current bar
+        self.next_time = None  # clock time of the next step
+
+    def get_loop_length(self):
+        # One bar is one pass through the loop dictionary
+        return sum(self.loop_dictionary.values())
+
+    def current_bar(self):
+        return self.bar
+
+    def next_boundary(self, now=None):
+        # Return the clock time of the next bar start, or None if no bar is playing
+        bar = self.bar
+        if bar is None:
+            return None
+        index, start, length = bar
+        if now is None:
+            now = self.clock()
+        if now <= start:
+            return start
+        end = start + length
+        if now <= end:
+            return end
+        # Later bars take the length of the pattern as it is now
+        next_length = self.get_loop_length()
+        if next_length <= 0:
+            return None
+        return end + math.ceil((now - end) / next_length) * next_length
+
+    def bar_at(self, when):
+        # Return the index of the bar that starts at or contains `when`, or
+        # None if no bar is playing
+        bar = self.bar
+        if bar is None:
+            return None
+        index, start, length = bar
+        if when < start + length:
+            return index
+        next_length = self.get_loop_length()
+        if next_length <= 0:
+            return None
+        return index + 1 + int((when - start - length) // next_length)
+
+    def add_layer(self, take, bars=1, first_bar=0):
+        # Load the take under its own key, then list.append (atomic) lets the
+        # loop thread pick it up without being stopped and without copying
+        # older layers. Returns the key, or None if all layer keys are used.
+        key = FIRST_LAYER_KEY + len(self.layers)
+        if key > LAST_KEY:
+            return None
+        samples = to_int16(take)
+        self.speaker.load_sound(key, samples)
+        self.layers.append((key, samples, bars, first_bar))
+        return key
+
+    def render_mixdown(self, first_pass=False):
+        # Return the whole bar as one buffer, or None to trigger each
+        # instrument. Only edits since the last bar are rendered again.
+        if self.samples is None:
+            return None
+        events = {}
+        offset = 0.0
+        for instrument, interval in list(self.loop_dictionary.items()):
+            # samples is changed in place by a sound reload
+            samples = self.samples.get(instrument)
+            if samples is None:
+                return None
+            events[('instrument', instrument)] = (int(round(offset * SAMPLERATE)), samples)
+            offset += interval
+        for key, take, bars, first_bar in list(self.layers):
+            if bars == 1:
+                events[('layer', key)] = (0, take)
+        mixdown = self.mixdown.sync(int(round(offset * SAMPLERATE)), events)
+        if mixdown is not None and first_pass:
+            return self.mixdown.first_pass()
+        return mixdown
+
+    def load_mixdown(self, mixdown):
+        # Load a rendered bar unless it is the one loaded already. A voice
+        # of the bar playing keeps the samples it started with.
+        if mixdown is not None and mixdown is not self.loaded:
+            self.speaker.load_sound(MIXDOWN_KEY, mixdown)
+            self.loaded = mixdown
+
+    def begin_bar(self, start):
+        # Start a bar at `start`: publish it, play the layers due and queue
+        # the instruments of the pattern as it is now
+        length = self.get_loop_length()
+        if length <= 0:
+            # Nothing to loop yet; no bar is playing until there is a pattern
+            self.bar = None
+            self.steps = []
+            self.bar_end = start + IDLE_TIME
+            return
+        index = self.bar_count
+        self.bar_count += 1
+        self.bar = (index, start, length)
+        self.bar_end = start + length
+
+        # Nothing plays before the first bar, so it has no wrapped tails
+        mixdown = self.render_mixdown(first_pass=index == 0)
+        for key, take, bars, first_bar in list(self.layers):
+            # One bar layers are already part of the mixdown. A layer first
+            # plays once the bars it was recorded over have passed.
+            if (mixdown is None or bars > 1) and index >= first_bar + bars and (index - first_bar) % bars == 0:
+                self.speaker.play(key)
+        if mixdown is not None:
+            self.load_mixdown(mixdown)
+            self.speaker.play(MIXDOWN_KEY)
+            self.steps = []
+            # Load the next bar now, so its trigger does not wait for a load
+            # unless the pattern changes during this bar
+            self.load_mixdown(self.render_mixdown())
+            return
+        steps = []
+        offset = 0.0
+        for instrument, interval in list(self.loop_dictionary.items()):
+            steps.append((start + offset, instrument))
+            offset += interval
+        self.steps = steps
+
+    def run_next(self):
+        # Play the step due at next_time and schedule the one after it.
+        # Steps are at absolute times, so bars do not drift.
+        if self.steps:
+            step_time, instrument = self.steps.pop(0)
+            self.speaker.play(instrument)
+        else:
+            self.begin_bar(self.next_time)
+        self.next_time = self.steps[0][0] if self.steps else self.bar_end
 
     def start_loop(self):
         if self.is_looping:
@@ -57,12 +218,21 @@ class Loop:
 
         self.is_looping = True
         self.loop_variable = True
-        
+        self.bar = None
+        self.bar_count = 0
+        self.steps = []
+        self.next_time = self.clock()
+        self.stopped.clear()
+
+        if not self.threaded:
+            return
+
         def loop_thread():
             while self.is_looping:
-                for instrument, interval in self.loop_dictionary.items():
-                    self.speaker.play(instrument)
-                    time.sleep(interval)
+                # Wakes up early if the loop is stopped
+                if self.stopped.wait(max(self.next_time - self.clock(), 0)):
+                    break
+                self.run_next()
 
         self.thread = Thread(target=loop_thread)
         self.thread.start()
@@ -73,6 +243,13 @@ class Loop:
 
         self.is_looping = False
         self.loop_variable = False
+        self.stopped.set()
 
         if self.thread:
-            self.thread.join()
\ No newline at end of file
+            self.thread.join()
+            self.thread = None
+        self.bar = None
+        self.steps = []
+        self.next_time = None
+        self.mixdown.clear()
+        self.loaded = None
@@ -0,0 +1,144 @@
+"""
+--------------------------------------------------------------------------
+Mixdown
+--------------------------------------------------------------------------
+License:   
+Copyright 2021-2024 - Yuka Aoyama
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Mixdown
+The MixdownCache class renders one bar of a loop (every instrument hit and one bar overdub at its offset) into a single int16 buffer, so a stable pattern is played as one sound per bar instead of re-triggering every instrument on every pass.
+
+The bar is split into segments. sync(self, length, events) compares the events with the ones already rendered, and only the segments covered by added, removed or changed events are rendered again. Sounds longer than what is left of the bar wrap round to its start, as they would when the loop repeats; first_pass(self) returns the bar without those tails, for the first time round. A bar whose buffers would not fit in max_bytes is not cached (sync returns None) and the loop falls back to triggering each instrument.
+
+"""
+import numpy as np
+
+SEGMENT_FRAMES = 4096
+MAX_BYTES = 8 * 1024 * 1024  # both buffers of the cached bar
+
+def to_int16(samples):
+    samples = np.asarray(samples).reshape(-1)
+    if samples.dtype == np.int16:
+        return samples
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+class MixdownCache:
+    def __init__(self, segment_frames=SEGMENT_FRAMES, max_bytes=MAX_BYTES):
+        self.segment_frames = segment_frames
+        self.max_bytes = max_bytes
+        self.length = 0
+        self.buffer = None
+        self.events = {}  # event id -> (offset, source samples, int16 samples)
+        self.dirty = set()  # indexes of segments to render again
+
+    def clear(self):
+        self.length = 0
+        self.buffer = None
+        self.events = {}
+        self.dirty = set()
+
+    def sync(self, length, events):
+        # length: frames in one bar; events: event id -> (offset, samples)
+        # Returns the int16 bar, or None if it does not fit in max_bytes
+        if length <= 0 or 2 * length * 2 > self.max_bytes:
+            self.clear()
+            return None
+        if length != self.length:
+            # Every offset moved, render the whole bar again
+            self.length = length
+            self.buffer = np.zeros(length, dtype=np.int16)
+            self.events = {}
+            self.dirty = set(range(self.segment_count()))
+
+        for event_id in list(self.events):
+            offset, source, samples = self.events[event_id]
+            if event_id not in events or events[event_id][0] % length != offset or events[event_id][1] is not source:
+                self.mark(offset, len(samples))
+                del self.events[event_id]
+        for event_id, (offset, source) in events.items():
+            if event_id not in self.events:
+                samples = to_int16(source)
+                self.events[event_id] = (offset % length, source, samples)
+                self.mark(offset % length, len(samples))
+
+        if self.dirty:
+            self.render()
+        return self.buffer
+
+    def first_pass(self):
+        # The synced bar as it sounds the first time round, with no tails
+        # wrapping in from a pass before it. Rendered in full; it is needed
+        # once per start of the loop.
+        mix = np.zeros(self.length, dtype=np.int32)
+        for offset, source, samples in self.events.values():
+            count = min(len(samples), self.length - offset)
+            mix[offset:offset + count] += samples[:count]
+        return np.clip(mix, -32768, 32767).astype(np.int16)
+
+    def segment_count(self):
+        return (self.length + self.segment_frames - 1) // self.segment_frames
+
+    def mark(self, offset, frames):
+        # Mark the segments covered by frames starting at offset; the part
+        # past the end of the bar wraps round to its start
+        if frames >= self.length:
+            self.dirty = set(range(self.segment_count()))
+            return
+        end = offset + frames
+        self.mark_range(offset, min(end, self.length))
+        if end > self.length:
+            self.mark_range(0, end - self.length)
+
+    def mark_range(self, start, stop):
+        # Mark the segments covering frames [start, stop) of the bar
+        if stop > start:
+            self.dirty.update(range(start // self.segment_frames,
+                                    (stop - 1) // self.segment_frames + 1))
+
+    def render(self):
+        # Render the dirty segments into a copy, then swap it in, so a bar
+        # handed out earlier is never changed while it is playing
+        buffer = self.buffer.copy()
+        mix = np.zeros(self.segment_frames, dtype=np.int32)
+        for segment in sorted(self.dirty):
+            start = segment * self.segment_frames
+            stop = min(start + self.segment_frames, self.length)
+            mix[:] = 0
+            for offset, source, samples in self.events.values():
+                # The event covers [offset, offset + len) on an unrolled
+                # timeline; check every pass of the bar it reaches into
+                for wrap in range((offset + len(samples) - 1) // self.length + 1):
+                    begin = max(start + wrap * self.length, offset)
+                    end = min(stop + wrap * self.length, offset + len(samples))
+                    if begin < end:
+                        target = begin - wrap * self.length - start
+                        mix[target:target + end - begin] += samples[begin - offset:end - offset]
+            np.clip(mix[:stop - start], -32768, 32767, out=buffer[start:stop], casting='unsafe')
+        self.buffer = buffer
+        self.dirty = set()
@@ -0,0 +1,113 @@
+"""
+--------------------------------------------------------------------------
+Onset
+--------------------------------------------------------------------------
+License:   
+Copyright 2021-2024 - Yuka Aoyama
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Onset
+Finds the hits in a recording so that one take of a beatbox or drum phrase can be split across several keys (see Keypad.save_slices).
+
+detect_onsets(take): Returns the sample positions of the hits in the take. The take is cut into overlapping frames with a strided view (no copy), and the spectral flux of a batch of frames is computed at once with NumPy, so a 30 second take takes a fraction of a second.
+
+slice_take(take, onsets): Splits the take at the onsets. Anything before the first hit is dropped.
+
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+SAMPLERATE = 44100
+FRAME_SIZE = 1024
+HOP_SIZE = 512
+BATCH_FRAMES = 256  # frames transformed per rfft call, bounds the working memory
+THRESHOLD_FRAMES = 16  # frames on each side averaged for the adaptive threshold
+THRESHOLD_RATIO = 1.5  # a hit must beat the local mean flux by this much
+MIN_GAP = 0.08  # seconds between two hits
+
+def frames(signal, frame_size=FRAME_SIZE, hop_size=HOP_SIZE):
+    # Overlapping frames as a strided view of the signal
+    count = 1 + (len(signal) - frame_size) // hop_size
+    stride = signal.strides[0]
+    return as_strided(signal, shape=(count, frame_size),
+                      strides=(hop_size * stride, stride), writeable=False)
+
+def spectral_flux(signal, frame_size=FRAME_SIZE, hop_size=HOP_SIZE):
+    # Sum of the increases in log magnitude from each frame to the next
+    window = np.hanning(frame_size).astype(np.float32)
+    view = frames(signal, frame_size, hop_size)
+    flux = np.zeros(len(view), dtype=np.float32)
+    previous = None
+    for start in range(0, len(view), BATCH_FRAMES):
+        batch = view[start:start + BATCH_FRAMES] * window
+        magnitude = np.log1p(np.abs(np.fft.rfft(batch, axis=1))).astype(np.float32)
+        if previous is None:
+            previous = magnitude[:1]
+        rise = np.diff(np.concatenate((previous, magnitude)), axis=0)
+        flux[start:start + len(batch)] = np.maximum(rise, 0).sum(axis=1)
+        previous = magnitude[-1:]
+    return flux
+
+def detect_onsets(take, samplerate=SAMPLERATE):
+    signal = np.asarray(take).reshape(-1)
+    if signal.dtype == np.int16:
+        signal = signal.astype(np.float32) / 32768
+    else:
+        signal = signal.astype(np.float32)
+    if len(signal) < FRAME_SIZE:
+        signal = np.pad(signal, (0, FRAME_SIZE - len(signal)))
+
+    flux = spectral_flux(signal)
+
+    # Adaptive threshold: mean flux around each frame (from a running sum)
+    total = np.concatenate(([0.0], np.cumsum(flux, dtype=np.float64)))
+    index = np.arange(len(flux))
+    low = np.maximum(index - THRESHOLD_FRAMES, 0)
+    high = np.minimum(index + THRESHOLD_FRAMES + 1, len(flux))
+    local_mean = (total[high] - total[low]) / (high - low)
+    threshold = local_mean * THRESHOLD_RATIO + flux.mean() * 0.1
+
+    # Local maxima above the threshold
+    padded = np.concatenate(([0.0], flux, [0.0]))
+    peaks = np.flatnonzero((flux > threshold) &
+                           (flux >= padded[:-2]) &
+                           (flux > padded[2:]))
+
+    # Drop hits closer than MIN_GAP to the previous one
+    min_frames = MIN_GAP * samplerate / HOP_SIZE
+    onsets = []
+    for peak in peaks:
+        if not onsets or peak - onsets[-1] >= min_frames:
+            onsets.append(peak)
+    return [int(peak) * HOP_SIZE for peak in onsets]
+
+def slice_take(take, onsets):
+    if not onsets:
+        return [take]
+    bounds = list(onsets) + [len(take)]
+    return [take[bounds[i]:bounds[i + 1]] for i in range(len(onsets))]
@@ -36,21 +36,35 @@ The RecordButton class (Red arcade button) manages audio recording. It provides
 
 start_record(self): This function listens for a button press. If pressed, it initiates recording using the USB microphone and flashes an LED to signal recording in progress.
 
-stop_record(self): Upon a button press, this function stops the recording, saves it using the keypad's save_recording(recording) method, and turns off the LED.
+stop_record(self, auto_slice): Upon a button press, this function stops the recording, saves it using the keypad's save_recording(recording) method, and turns off the LED. With auto_slice, the take is split at its hits across free keys with keypad.save_slices(recording).
+
+measure_latency(self): Measures the input/output round trip latency by playing a short noise burst. Call it at setup, while nothing is playing.
+
+start_overdub(self, loop): Records over a playing loop. Recording starts on the next bar of the loop, and the take is shifted by the measured input/output latency (or the latency the devices report, if it was not measured) so it lines up with what was heard.
+
+stop_overdub(self): Stops the overdub at the end of the current bar and adds the take to the loop as a new layer.
 
 """
 import threading
+import time
+import numpy as np
 import sounddevice as sd
-from keypad import Keypad
+
+SAMPLERATE = 44100
+BLOCKSIZE = 256  # frames per callback while overdubbing
+STREAM_START_TIME = 0.05  # seconds allowed for the input stream to start
+LATENCY_BURST = 1024  # frames of noise played by measure_latency
 
 class Record:
-    def __init__(self, button_pin, led_pin):
+    def __init__(self, button_pin, led_pin, keypad):
         self.button_pin = button_pin
         self.led_pin = led_pin
         self.recording = None
         self.is_recording = False
+        self.is_overdubbing = False
         self.thread = None
-        self.keypad = Keypad()
+        self.keypad = keypad  # saves the takes (Keypad.save_recording)
+        self.latency = None  # seconds, measured round trip output -> input
 
     def start_record(self):
         if self.is_recording:
@@ -60,7 +74,7 @@ class Record:
         self.led_pin.value = True
 
         def record_audio():
-            samplerate = 44100
+            samplerate = SAMPLERATE
             duration = 5  # seconds
 
             # Start recording in a separate thread
@@ -72,8 +86,128 @@ class Record:
         self.thread = threading.Thread(target=record_audio)
         self.thread.start()
 
-    def stop_record(self):
+    def stop_record(self, auto_slice=False):
         if self.is_recording:
             self.thread.join()
-            self.keypad.save_recording(self.recording)
-            self.recording = None
\ No newline at end of file
+            if auto_slice:
+                self.keypad.save_slices(self.recording)
+            else:
+                self.keypad.save_recording(self.recording)
+            self.recording = None
+
+    def reported_latency(self):
+        # Round trip latency the audio devices report
+        return sd.query_devices(kind='input')['default_low_input_latency'] + \
+            sd.query_devices(kind='output')['default_low_output_latency']
+
+    def measure_latency(self, samplerate=SAMPLERATE):
+        # Play a short noise burst and find it in the input to get the round
+        # trip latency. Call this at setup, while nothing is playing and
+        # before the AudioEngine owns the output device. The burst is found
+        # by cross-correlating with it, so other sound in the room does not
+        # count as the echo. Needs the speaker audible to the microphone;
+        # falls back to the latency the devices report.
+        burst = np.random.default_rng(0).uniform(-0.5, 0.5, LATENCY_BURST).astype('float32')
+        signal = np.zeros((samplerate // 2, 1), dtype='float32')
+        signal[:LATENCY_BURST, 0] = burst
+        response = sd.playrec(signal, samplerate=samplerate, channels=1)
+        sd.wait()
+
+        # Cross-correlation through the FFT: lag k is sum(response[n + k] * burst[n])
+        size = 1 << (len(response) + LATENCY_BURST).bit_length()
+        correlation = np.fft.irfft(np.fft.rfft(response[:, 0], size) *
+                                   np.conj(np.fft.rfft(burst, size)), size)[:len(response)]
+        correlation = np.abs(correlation)
+        peak = int(np.argmax(correlation))
+        # Only trust a peak that clearly stands out from the background
+        if correlation[peak] > 8 * np.median(correlation) and correlation[peak] > 0:
+            self.latency = peak / samplerate
+        else:
+            self.latency = self.reported_latency()
+        return self.latency
+
+    def start_overdub(self, loop, max_bars=4):
+        # Returns False if there is no playing bar to record over
+        if self.is_recording or not loop.is_looping or loop.get_loop_length() <= 0:
+            return False
+
+        # Never play a calibration burst in the middle of a performance
+        if self.latency is None:
+            self.latency = self.reported_latency()
+
+        self.is_recording = True
+        self.is_overdubbing = True
+        self.led_pin.value = True
+
+        def record_overdub():
+            samplerate = SAMPLERATE
+            bar_frames = int(round(loop.get_loop_length() * samplerate))
+
+            # Allocate once up front; the callback only copies blocks into it
+            buffer = np.zeros((max_bars * bar_frames, 1), dtype='float32')
+            done = threading.Event()
+            state = {'position': None, 'bars': 0}
+
+            def callback(indata, frames, time_info, status):
+                # Time of the first frame of the block on the stream clock
+                adc = time_info.inputBufferAdcTime or time_info.currentTime - stream.latency
+                skip = int(round((capture_start - adc) * samplerate))
+                if skip >= frames:
+                    return  # still before the bar
+                if state['position'] is None:
+                    # A late first block leaves its missed frames silent, so
+                    # the take stays aligned to the bar
+                    state['position'] = min(max(-skip, 0), len(buffer))
+                block = indata[max(skip, 0):]
+                position = state['position']
+                count = min(len(block), len(buffer) - position)
+                buffer[position:position + count] = block[:count]
+                state['position'] = position + count
+                while state['position'] >= (state['bars'] + 1) * bar_frames:
+                    state['bars'] += 1
+                    if not self.is_recording or state['bars'] == max_bars:
+                        raise sd.CallbackStop
+
+            # Open the stream before the bar so opening it does not delay the take
+            stream = sd.InputStream(samplerate=samplerate, blocksize=BLOCKSIZE, channels=1,
+                                    dtype='float32', callback=callback,
+                                    finished_callback=done.set)
+            clock_offset = stream.time - time.monotonic()
+
+            # Snap the start to the next bar that leaves time to start the
+            # stream; take its index now, as the loop may be stopped before
+            # the take is done
+            start = loop.next_boundary(time.monotonic() + STREAM_START_TIME)
+            first_bar = loop.bar_at(start) if start is not None else None
+            if first_bar is None:
+                # The loop stopped or its pattern was cleared; no take
+                stream.close()
+                self.is_recording = False
+                self.is_overdubbing = False
+                self.led_pin.value = False
+                return
+
+            # The ADC timestamps already include the input latency, so only the
+            # output side of the round trip is left to shift by
+            capture_start = start + clock_offset + max(self.latency - stream.latency, 0)
+
+            stream.start()
+            done.wait()
+            stream.close()
+
+            if state['bars']:
+                loop.add_layer(buffer[:state['bars'] * bar_frames], state['bars'], first_bar)
+            self.is_recording = False
+            self.is_overdubbing = False
+            self.led_pin.value = False
+
+        self.thread = threading.Thread(target=record_overdub)
+        self.thread.start()
+        return True
+
+    def stop_overdub(self):
+        # The take stops at the end of the current bar
+        if self.thread:
+            self.is_recording = False
+            self.thread.join()
+            self.thread = None
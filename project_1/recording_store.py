@@ -0,0 +1,185 @@
+"""
+--------------------------------------------------------------------------
+Recording Store
+--------------------------------------------------------------------------
+License:   
+Copyright 2021-2024 - Yuka Aoyama
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Recording Store
+The RecordingStore class keeps the takes from Record under a global memory budget. Takes are stored as int16 (half the size of the float32 from sounddevice). The most recently used takes stay in RAM; when the budget is exceeded the least recently used ones are spilled to memory-mapped files on local storage and paged back in when their key is pressed.
+
+put(self, key, take): Stores a float take (-1.0 to 1.0) as int16 under the key.
+
+get(self, key): Returns the int16 samples of the key, paging them back in if they were spilled. Returns None when the on_resident hook holds the RAM copy (see below).
+
+remove(self, key): Forgets the take and deletes its spill file.
+
+on_resident(key, samples) / on_evict(key): Optional hooks called when a take comes into RAM (stored or paged in) and when it leaves RAM (spilled or removed). Keypad uses them to keep exactly the resident takes loaded in the AudioEngine. With on_resident set, the copy it makes (the AudioEngine's shared memory) is the only one the budget counts: the store drops its own array once the take is on disk, and a page-in reads the file straight into the hook.
+
+Every take is written to its spill file once, by a background writer thread, right after put(). Spilling a take only drops it from RAM, so the get() on a key press never waits for a write.
+
+close(self): Forgets all takes and deletes the spill files. Spill files go to project_1/recordings by default, on the board's local storage rather than a tmpfs /tmp that would keep them in RAM.
+
+"""
+from collections import OrderedDict
+import itertools
+import os
+import queue
+import threading
+import numpy as np
+
+DEFAULT_BUDGET = 64 * 1024 * 1024  # bytes of resident takes
+DEFAULT_SPILL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
+class RecordingStore:
+    def __init__(self, budget=DEFAULT_BUDGET, spill_dir=None, on_resident=None, on_evict=None):
+        self.budget = budget
+        self.on_resident = on_resident
+        self.on_evict = on_evict
+        self.spill_dir = spill_dir or DEFAULT_SPILL_DIR
+        self.resident = OrderedDict()  # key -> bytes in RAM, least recently used first
+        self.arrays = {}  # key -> int16 array of a resident take, unless on_resident holds it
+        self.files = {}  # key -> (path, shape) of takes already written to disk
+        self.pending = {}  # key -> int16 array queued for the writer, not on disk yet
+        self.resident_bytes = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()  # (key, samples, path) to write, None to stop
+        self.writer = None
+        self.serial = itertools.count()  # file names are never reused
+
+    def __contains__(self, key):
+        return key in self.resident or key in self.files or key in self.pending
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        return list(self.resident) + [key for key in set(self.files) | set(self.pending)
+                                      if key not in self.resident]
+
+    def put(self, key, take):
+        samples = np.clip(np.asarray(take, dtype='float32'), -1.0, 1.0)
+        samples = (samples * 32767).astype('int16')
+        with self.lock:
+            self._discard(key)
+            # Takes never change once stored, so each is written once, in
+            # the background; spilling it later only drops it from RAM
+            path = os.path.join(self.spill_dir, "{0}-{1}.pcm".format(key, next(self.serial)))
+            self.pending[key] = samples
+            self.queue.put((key, samples, path))
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_files, daemon=True)
+                self.writer.start()
+            self._make_resident(key, samples)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.resident:
+                self.resident.move_to_end(key)
+                return self.arrays.get(key)
+            if key in self.pending:
+                # Spilled before the writer got to it; still in RAM
+                samples = self.pending[key]
+            else:
+                path, shape = self.files[key]
+                samples = np.memmap(path, dtype='int16', mode='r', shape=shape)
+                if self.on_resident is None:
+                    # One sequential read of the file back into RAM
+                    samples = np.array(samples)
+            self._make_resident(key, samples)
+            return self.arrays.get(key)
+
+    def remove(self, key):
+        with self.lock:
+            self._discard(key)
+
+    def close(self):
+        # Let the writer finish what is queued, then delete everything
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        with self.lock:
+            for key in self.keys():
+                self._discard(key)
+            try:
+                os.rmdir(self.spill_dir)
+            except OSError:
+                pass  # not created, or holds files that are not ours
+
+    def _write_files(self):
+        # Writer thread: disk writes happen here, never under the lock
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            key, samples, path = item
+            os.makedirs(self.spill_dir, exist_ok=True)
+            spill = np.memmap(path, dtype='int16', mode='w+', shape=samples.shape)
+            spill[:] = samples
+            spill.flush()
+            del spill
+            with self.lock:
+                if self.pending.get(key) is samples:
+                    del self.pending[key]
+                    self.files[key] = (path, samples.shape)
+                    continue
+            os.remove(path)  # removed or replaced while it was written
+
+    def _make_resident(self, key, samples):
+        self.resident[key] = samples.nbytes
+        self.resident_bytes += samples.nbytes
+        if self.on_resident is None:
+            self.arrays[key] = samples
+        else:
+            # The hook's copy is the only one the store counts; its own array
+            # is only kept until the writer has it on disk
+            self.on_resident(key, samples)
+        # Spill the coldest takes, but always keep the one just used
+        while self.resident_bytes > self.budget and len(self.resident) > 1:
+            self._spill(*self.resident.popitem(last=False))
+
+    def _spill(self, key, nbytes):
+        # Only drops the take from RAM; its file is written (or queued) once
+        # when it is stored
+        self.arrays.pop(key, None)
+        self.resident_bytes -= nbytes
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def _discard(self, key):
+        if key in self.resident:
+            self.resident_bytes -= self.resident.pop(key)
+            self.arrays.pop(key, None)
+            if self.on_evict is not None:
+                self.on_evict(key)
+        self.pending.pop(key, None)  # the writer deletes the file it was writing
+        if key in self.files:
+            path, shape = self.files.pop(key)
+            os.remove(path)
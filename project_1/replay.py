@@ -0,0 +1,308 @@
+"""
+--------------------------------------------------------------------------
+Replay
+--------------------------------------------------------------------------
+License:   
+Copyright 2021-2024 - Yuka Aoyama
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Replay
+Feeds an event log recorded with keypad.py --capture back through the Keypad (and the loop / record logic behind its keys and buttons) without hardware, so a trace from a real session becomes a repeatable benchmark. Button events go through the same handlers as on the board (Keypad.connect_buttons); the record button records a fixed tone instead of the microphone. The loop and the takes are driven by the logged timestamps rather than by threads on the wall clock.
+
+Sounds are rendered offline by OfflineEngine at the logged timestamps, so the audio hash only depends on which sounds the logic triggered and when. Separately, the events are dispatched in real time and the report shows how late each one was handled.
+
+Usage: python replay.py events.bin [--expect HASH] [--fast] [--auto-slice]
+
+"""
+import argparse
+import hashlib
+import sys
+import time
+import numpy as np
+from audio_engine import SAMPLERATE
+from capture import read_log, KEY, BUTTON
+import keypad
+from loop import Loop
+
+RECORD_TIME = 5  # seconds, as Record
+STREAM_START_TIME = 0.05  # seconds, as Record
+
+class ReplayLeds:
+    def fill(self, value):
+        pass
+
+class ReplayTrellis:
+    # Stands in for adafruit_trellis.Trellis; returns the queued events
+    def __init__(self):
+        self.led = ReplayLeds()
+        self.pressed = []
+        self.released = []
+
+    def read_buttons(self):
+        pressed, released = self.pressed, self.released
+        self.pressed, self.released = [], []
+        return pressed, released
+
+class ReplayRecord:
+    # Stands in for Record on the replay clock. A take is a fixed tone of
+    # Record's 5 seconds: the record button toggles, and a stop press after
+    # the take has ended saves nothing and starts a new take, as on the
+    # board. Overdubs record a tone over the next bars of the loop like
+    # Record.start_overdub; replay() adds the layer when its last bar ends.
+    def __init__(self, pad, clock):
+        self.pad = pad
+        self.clock = clock  # seconds on the replay clock
+        self.until = None  # replay time the take in progress ends
+        self.overdub = None  # [loop, start, bar length, first_bar, max_bars]
+
+    @property
+    def is_recording(self):
+        return self.until is not None and self.clock() < self.until
+
+    @property
+    def is_overdubbing(self):
+        return self.overdub is not None and self.is_recording
+
+    def start_record(self):
+        if self.is_recording:
+            return
+        self.overdub = None
+        self.until = self.clock() + RECORD_TIME
+
+    def stop_record(self, auto_slice=False):
+        if self.is_recording:
+            take = tone(RECORD_TIME * SAMPLERATE, 440)
+            if auto_slice:
+                self.pad.save_slices(take)
+            else:
+                self.pad.save_recording(take)
+            self.until = None
+
+    def start_overdub(self, loop, max_bars=4):
+        if self.is_recording or not loop.is_looping or loop.get_loop_length() <= 0:
+            return False
+        start = loop.next_boundary(self.clock() + STREAM_START_TIME)
+        first_bar = loop.bar_at(start) if start is not None else None
+        if first_bar is None:
+            return True  # Record abandons the take in its thread
+        length = loop.get_loop_length()
+        self.overdub = [loop, start, length, first_bar, max_bars]
+        self.until = start + max_bars * length
+        return True
+
+    def stop_overdub(self):
+        # The take stops at the end of the current bar
+        if self.is_overdubbing:
+            loop, start, length, first_bar, max_bars = self.overdub
+            bars = min(max(int((self.clock() - start) // length) + 1, 1), max_bars)
+            self.until = start + bars * length
+
+    def overdub_end(self):
+        return self.until if self.overdub is not None else None
+
+    def finish_overdub(self):
+        loop, start, length, first_bar, max_bars = self.overdub
+        bars = int(round((self.until - start) / length))
+        loop.add_layer(tone(bars * int(round(length * SAMPLERATE)), 220), bars, first_bar)
+        self.overdub = None
+
+def tone(frames, frequency):
+    take = 0.5 * np.sin(2 * np.pi * frequency * np.arange(frames) / SAMPLERATE)
+    return take.astype(np.float32).reshape(-1, 1)
+
+class OfflineEngine:
+    # Same commands as AudioEngine, rendered to a buffer instead of a device
+    def __init__(self):
+        self.samples = {}
+        self.commands = []  # (frame, command, key, samples at that time)
+        self.now = 0  # frame of the event being replayed
+
+    def load(self, key, samples):
+        # A copy, as AudioEngine.load copies into shared memory
+        self.samples[key] = np.array(samples, dtype=np.int16).reshape(-1)
+        return True
+
+    def unload(self, key):
+        self.samples.pop(key, None)
+        return True
+
+    def trigger(self, key):
+        self.commands.append((self.now, 'trigger', key, self.samples.get(key)))
+        return True
+
+    def loop(self, key):
+        self.commands.append((self.now, 'loop', key, self.samples.get(key)))
+        return True
+
+    def stop(self, key):
+        self.commands.append((self.now, 'stop', key, None))
+        return True
+
+    def stop_all(self):
+        self.commands.append((self.now, 'stop_all', None, None))
+        return True
+
+    def close(self):
+        pass
+
+    def render(self, tail=SAMPLERATE):
+        # Voices of a key are cut by the next trigger / stop of that key,
+        # like the AudioEngine callback does
+        end = (self.commands[-1][0] if self.commands else 0) + tail
+        starts = {}
+        voices = []
+
+        def cut(key, frame):
+            if key in starts:
+                start, looping, data = starts.pop(key)
+                voices.append((data, start, frame, looping))
+
+        for frame, command, key, data in self.commands:
+            if command == 'stop_all':
+                for playing in list(starts):
+                    cut(playing, frame)
+                continue
+            cut(key, frame)
+            if command != 'stop' and data is not None:
+                starts[key] = (frame, command == 'loop', data)
+        for key in list(starts):
+            cut(key, end)
+
+        mix = np.zeros(end, dtype=np.int32)
+        for data, start, stop, looping in voices:
+            if len(data) == 0:
+                continue
+            length = stop - start
+            if looping:
+                data = np.tile(data, length // len(data) + 1)
+            data = data[:length]
+            mix[start:start + len(data)] += data
+        return np.clip(mix, -32768, 32767).astype(np.int16)
+
+def replay(path, fast=False, auto_slice=False):
+    events = read_log(path)
+    trellis = ReplayTrellis()
+    engine = OfflineEngine()
+    pad = keypad.Keypad(trellis, engine)
+    pad.boot()
+
+    # Same button handlers as keypad.py's main, so BUTTON events drive the
+    # record and loop logic. The loop and the takes run on the replay clock
+    # instead of threads, so they line up with the logged events.
+    now = [0.0]  # seconds since the first event
+    loop = Loop(None, False, keypad.loop_dictionary, pad, samples=pad.samples,
+                clock=lambda: now[0], threaded=False)
+    record = ReplayRecord(pad, lambda: now[0])
+    pad.connect_buttons(record, loop, auto_slice)
+
+    def set_time(when):
+        now[0] = when
+        engine.now = int(round(when * SAMPLERATE))
+
+    def advance(until):
+        # Run the loop steps and the ends of overdubs due by `until`, in time
+        # order. A take reaches the loop just after the bar it ends on starts.
+        while True:
+            step = loop.next_time if loop.is_looping else None
+            end = record.overdub_end()
+            if end is not None and end <= until and (step is None or end < step):
+                set_time(end)
+                record.finish_overdub()
+            elif step is not None and step <= until:
+                set_time(step)
+                loop.run_next()
+            else:
+                break
+        set_time(until)
+
+    origin = events[0][0] if events else 0
+    started = time.monotonic_ns()
+    lateness = []
+    handling = []
+
+    index = 0
+    while index < len(events):
+        # Events logged in the same handle_press call are replayed together
+        timestamp = events[index][0]
+        group = []
+        while index < len(events) and events[index][0] - timestamp < 1000000:
+            group.append(events[index])
+            index += 1
+
+        offset = timestamp - origin
+        if not fast:
+            delay = started + offset - time.monotonic_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+        dispatched = time.monotonic_ns()
+        advance(offset / 1e9)
+
+        for _, kind, number, value in group:
+            if kind == KEY:
+                (trellis.pressed if value else trellis.released).append(number)
+        if trellis.pressed or trellis.released:
+            pad.handle_press()
+        for _, kind, number, value in group:
+            if kind == BUTTON:
+                pad.handle_button(number, bool(value))
+
+        done = time.monotonic_ns()
+        if not fast:
+            lateness.append((dispatched - started - offset) / 1e6)
+        handling.append((done - dispatched) / 1e6)
+
+    loop.stop_loop()
+    keypad.recording_store.close()
+
+    audio = engine.render()
+    return hashlib.sha256(audio.tobytes()).hexdigest(), len(events), lateness, handling
+
+def summary(name, values):
+    if not values:
+        return "{0}: n/a".format(name)
+    values = np.asarray(values)
+    return "{0}: mean {1:.3f} ms, p99 {2:.3f} ms, max {3:.3f} ms".format(
+        name, values.mean(), np.percentile(values, 99), values.max())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('log', help="event log recorded with keypad.py --capture")
+    parser.add_argument('--expect', help="audio hash the replay must render")
+    parser.add_argument('--fast', action='store_true', help="do not wait for the logged timestamps")
+    parser.add_argument('--auto-slice', action='store_true', help="as keypad.py --auto-slice (not in the log)")
+    args = parser.parse_args()
+
+    digest, count, lateness, handling = replay(args.log, args.fast, args.auto_slice)
+    print("events:   {0}".format(count))
+    print(summary("lateness", lateness))
+    print(summary("handling", handling))
+    print("audio:    {0}".format(digest))
+
+    if args.expect and args.expect != digest:
+        print("audio hash mismatch, expected {0}".format(args.expect))
+        sys.exit(1)
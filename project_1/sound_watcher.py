@@ -0,0 +1,129 @@
+"""
+--------------------------------------------------------------------------
+Sound Watcher
+--------------------------------------------------------------------------
+License:   
+Copyright 2021-2024 - Yuka Aoyama
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Sound Watcher
+The SoundWatcher class watches the sounds directory with inotify. When wav files are added, changed or removed, it decodes only those files in its own thread and hands the result to Keypad.swap_sounds, which swaps them into the live key map in one step. Nothing is decoded on the press path, and voices that are already playing keep their old samples until they finish.
+
+start(self): Starts watching in a background thread.
+
+stop(self): Stops watching.
+
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+import wave
+from audio_engine import read_wav
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CLOSE_WRITE = 0x00000008
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len of name
+SETTLE_TIME = 0.2  # seconds to collect events before decoding, so a copy of a whole pack is one swap
+
+class SoundWatcher:
+    def __init__(self, directory, keypad):
+        self.directory = directory
+        self.keypad = keypad
+        self.thread = None
+        self.is_watching = False
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    def start(self):
+        if self.is_watching:
+            return
+
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        if self.libc.inotify_add_watch(self.fd, self.directory.encode(), WATCH_MASK) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for {0}".format(self.directory))
+
+        self.is_watching = True
+        self.thread = threading.Thread(target=self.watch_thread, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.is_watching:
+            return
+
+        self.is_watching = False
+        if self.thread:
+            self.thread.join()
+        os.close(self.fd)
+
+    def read_names(self, timeout):
+        # Return the wav file names of the events that arrive within timeout
+        names = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return names
+        data = os.read(self.fd, 4096)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode()
+            offset += length
+            if name.lower().endswith('.wav'):
+                names.add(name)
+        return names
+
+    def watch_thread(self):
+        while self.is_watching:
+            names = self.read_names(0.5)
+            if not names:
+                continue
+            deadline = time.monotonic() + SETTLE_TIME
+            while time.monotonic() < deadline:
+                names |= self.read_names(max(deadline - time.monotonic(), 0))
+
+            changes = {}  # file name -> int16 samples, or None if removed
+            for name in names:
+                path = os.path.join(self.directory, name)
+                if not os.path.exists(path):
+                    changes[name] = None
+                    continue
+                try:
+                    changes[name] = read_wav(path)
+                except (wave.Error, EOFError, ValueError):
+                    continue  # leave the old sound on the key
+            if changes:
+                self.keypad.swap_sounds(changes)
@@ -0,0 +1,63 @@
+"""
+Tests for Loop driven through the real Keypad and the OfflineEngine from
+replay.py, on a clock the test advances.
+"""
+import numpy as np
+import keypad
+from loop import Loop, FIRST_LAYER_KEY, MIXDOWN_KEY
+from replay import ReplayTrellis, OfflineEngine, SAMPLERATE
+
+BAR = 0.5  # seconds
+
+def run_until(loop, engine, clock, until):
+    # Run every loop step due by until, at the step's own time
+    while loop.next_time <= until:
+        clock[0] = loop.next_time
+        engine.now = int(round(clock[0] * SAMPLERATE))
+        loop.run_next()
+
+def test_layer_plays_through_keypad():
+    engine = OfflineEngine()
+    pad = keypad.Keypad(ReplayTrellis(), engine)
+    clock = [0.0]
+    loop = Loop(None, None, {0: BAR}, pad, clock=lambda: clock[0], threaded=False)
+    loop.start_loop()
+    run_until(loop, engine, clock, 0.0)
+
+    # A one bar overdub of bar 0, added while bar 0 plays
+    take = np.full((int(BAR * SAMPLERATE), 1), 0.25, dtype=np.float32)
+    key = loop.add_layer(take, 1, loop.bar_at(0.0))
+    assert key == FIRST_LAYER_KEY
+    run_until(loop, engine, clock, 2 * BAR)
+    loop.stop_loop()
+
+    frames = [frame for frame, command, k, _ in engine.commands if k == key]
+    assert frames == [int(BAR * SAMPLERATE), int(2 * BAR * SAMPLERATE)]
+    audio = engine.render()
+    assert audio[int(BAR * SAMPLERATE) + 100] == int(0.25 * 32767)
+    assert audio[100] == 0
+
+def test_mixdown_plays_through_keypad():
+    engine = OfflineEngine()
+    pad = keypad.Keypad(ReplayTrellis(), engine)
+    loads = []
+    engine_load = engine.load
+    engine.load = lambda key, samples: loads.append(key) or engine_load(key, samples)
+    # A sound one and a half bars long, so its tail wraps into the next bar
+    bar = int(BAR * SAMPLERATE)
+    pad.swap_sounds({keypad.sound_map[0]: np.full(bar + bar // 2, 1000, dtype=np.int16)})
+    clock = [0.0]
+    loop = Loop(None, None, {0: BAR}, pad, samples=pad.samples,
+                clock=lambda: clock[0], threaded=False)
+    loop.start_loop()
+    run_until(loop, engine, clock, 3 * BAR)
+    loop.stop_loop()
+
+    # The first pass and the steady bar are each loaded once
+    assert loads.count(MIXDOWN_KEY) == 2
+    triggers = [frame for frame, command, key, _ in engine.commands if key == MIXDOWN_KEY]
+    assert triggers == [0, bar, 2 * bar, 3 * bar]
+    audio = engine.render()
+    assert audio[bar // 4] == 1000  # first bar, no tail wrapped in
+    assert audio[bar + bar // 4] == 2000  # tail of the bar before
+    assert audio[bar + 3 * bar // 4] == 1000
@@ -0,0 +1,34 @@
+"""
+Tests for MixdownCache: an incrementally updated bar must match the same
+events rendered from scratch.
+"""
+import numpy as np
+from mixdown import MixdownCache
+
+SEGMENT_FRAMES = 4096
+LENGTH = 88200  # a 2 second bar, not a multiple of SEGMENT_FRAMES
+
+def full_render(events):
+    cache = MixdownCache(SEGMENT_FRAMES)
+    return cache.sync(LENGTH, events).copy()
+
+def test_wrapped_tail_is_rendered():
+    cache = MixdownCache(SEGMENT_FRAMES)
+    cache.sync(LENGTH, {})
+    buffer = cache.sync(LENGTH, {'hit': (87000, np.full(10000, 500, dtype=np.int16))})
+    assert buffer[LENGTH - 1] == 500
+    assert buffer[8799] == 500
+    assert buffer[8800] == 0
+
+def test_sync_matches_full_render():
+    rng = np.random.default_rng(1)
+    cache = MixdownCache(SEGMENT_FRAMES)
+    events = {}
+    for step in range(300):
+        if events and rng.random() < 0.4:
+            del events[sorted(events)[rng.integers(len(events))]]
+        else:
+            frames = int(rng.integers(1, 3 * SEGMENT_FRAMES))
+            samples = rng.integers(-2000, 2000, frames).astype(np.int16)
+            events[step] = (int(rng.integers(0, LENGTH)), samples)
+        assert np.array_equal(cache.sync(LENGTH, events), full_render(events)), step
@@ -0,0 +1,34 @@
+"""
+Tests for detect_onsets on a synthetic take with hits at known positions.
+"""
+import time
+import numpy as np
+from onset import detect_onsets, slice_take, SAMPLERATE, HOP_SIZE
+
+def synthetic_take(seconds, hits):
+    # Quiet noise with a decaying noise burst at each hit
+    rng = np.random.default_rng(0)
+    take = rng.normal(0, 0.002, seconds * SAMPLERATE).astype(np.float32)
+    burst = rng.normal(0, 0.5, 4096) * np.exp(-np.arange(4096) / 600)
+    for hit in hits:
+        take[hit:hit + len(burst)] += burst[:len(take) - hit]
+    return take.reshape(-1, 1)
+
+def test_hits_are_found():
+    hits = [int(SAMPLERATE * (0.25 + 0.35 * n)) for n in range(8)]
+    onsets = detect_onsets(synthetic_take(3, hits))
+    assert len(onsets) == len(hits)
+    for onset, hit in zip(onsets, hits):
+        assert abs(onset - hit) <= 2 * HOP_SIZE
+
+    pieces = slice_take(synthetic_take(3, hits), onsets)
+    assert len(pieces) == len(hits)
+
+def test_thirty_second_take_is_fast():
+    hits = [int(SAMPLERATE * (0.1 + 0.25 * n)) for n in range(119)]
+    take = synthetic_take(30, hits)
+    start = time.perf_counter()
+    onsets = detect_onsets(take)
+    elapsed = time.perf_counter() - start
+    assert len(onsets) == len(hits)
+    assert elapsed < 1.0  # about 30 ms on a desktop
@@ -0,0 +1,59 @@
+"""
+Tests for RecordingStore: takes stay within the budget, spill to disk and
+come back unchanged.
+"""
+import threading
+import time
+import numpy as np
+from recording_store import RecordingStore
+
+FRAMES = 1000
+
+def take(value):
+    return np.full((FRAMES, 1), value, dtype=np.float32)
+
+def test_hook_holds_the_only_resident_copy(tmp_path):
+    loaded = {}
+    store = RecordingStore(budget=FRAMES * 2, spill_dir=str(tmp_path / "spill"),
+                           on_resident=lambda key, samples: loaded.__setitem__(key, np.array(samples)),
+                           on_evict=loaded.pop)
+    store.put(0, take(0.5))
+    store.put(1, take(0.25))
+
+    # One take fits in the budget, counted once
+    assert list(loaded) == [1]
+    assert store.arrays == {}
+    assert store.resident_bytes == FRAMES * 2
+
+    # Paging the spilled take in hands its samples to the hook again
+    assert store.get(0) is None
+    assert list(loaded) == [0]
+    assert np.all(loaded[0] == int(0.5 * 32767))
+    store.close()
+    assert not (tmp_path / "spill").exists()
+
+def test_spill_does_not_wait_for_the_writer(tmp_path):
+    store = RecordingStore(budget=FRAMES * 2, spill_dir=str(tmp_path / "spill"))
+    release = threading.Event()
+    write_files = store._write_files
+
+    def held_writer():
+        release.wait()
+        write_files()
+
+    store._write_files = held_writer
+
+    # The writer is held, so nothing is on disk yet when take 0 is spilled
+    store.put(0, take(0.5))
+    store.put(1, take(0.25))
+    assert list(store.resident) == [1]
+    assert store.files == {}
+    assert np.all(store.get(0) == int(0.5 * 32767))
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while len(store.files) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(store.files) == [0, 1]
+    store.close()
+    assert not (tmp_path / "spill").exists()
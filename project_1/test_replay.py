@@ -0,0 +1,64 @@
+"""
+Tests for replay.py: the stand-in record button and the loop run on the
+replay clock, the same way every time.
+"""
+import keypad
+from capture import MAGIC, EVENT, KEY, BUTTON
+from loop import Loop
+from replay import replay, ReplayRecord, ReplayTrellis, OfflineEngine, RECORD_TIME, SAMPLERATE
+
+def write_log(path, events):
+    # events: (seconds, kind, index, value)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        for seconds, kind, index, value in events:
+            f.write(EVENT.pack(int(seconds * 1e9), kind, index, value))
+
+def test_take_stopped_after_it_ended_is_lost():
+    pad = keypad.Keypad(ReplayTrellis(), OfflineEngine())
+    saved = []
+    pad.save_recording = saved.append
+    now = [0.0]
+    record = ReplayRecord(pad, lambda: now[0])
+    pad.connect_buttons(record, Loop(None, False, {}, pad, threaded=False))
+
+    for when in (0.0, 6.0, 7.0):
+        now[0] = when
+        pad.handle_button(keypad.RECORD_BUTTON, True)
+        pad.handle_button(keypad.RECORD_BUTTON, False)
+
+    # The first take ended before the press at 6 s, which started a new one
+    assert len(saved) == 1
+    assert len(saved[0]) == RECORD_TIME * SAMPLERATE
+
+def test_loop_replay_is_repeatable(tmp_path):
+    path = str(tmp_path / "events.bin")
+    write_log(path, [(0.0, BUTTON, keypad.LOOP_BUTTON, 1),
+                     (0.1, BUTTON, keypad.LOOP_BUTTON, 0),
+                     (1.3, KEY, 3, 1),
+                     (1.4, KEY, 3, 0),
+                     (2.0, BUTTON, keypad.LOOP_BUTTON, 1)])
+    keypad.loop_dictionary[0] = 0.25
+    keypad.loop_dictionary[5] = 0.25
+    try:
+        digests = [replay(path, fast=True)[0] for _ in range(3)]
+    finally:
+        keypad.loop_dictionary.clear()
+    assert len(set(digests)) == 1
+
+    # Without the loop only the key is heard
+    write_log(path, [(1.3, KEY, 3, 1), (1.4, KEY, 3, 0)])
+    assert replay(path, fast=True)[0] != digests[0]
+
+def test_auto_slice_reaches_save_slices():
+    pad = keypad.Keypad(ReplayTrellis(), OfflineEngine())
+    sliced = []
+    pad.save_slices = sliced.append
+    now = [0.0]
+    pad.connect_buttons(ReplayRecord(pad, lambda: now[0]), Loop(None, False, {}, pad, threaded=False),
+                        auto_slice=True)
+
+    for when in (0.0, 1.0):
+        now[0] = when
+        pad.handle_button(keypad.RECORD_BUTTON, True)
+    assert len(sliced) == 1
@@ -36,6 +36,11 @@ THE POSSIBILITY OF SUCH DAMAGE.
 Blinks the USR3 LED on PocketBeagle at 5 Hz (i.e. 5 full on/off cycles per second)
 using the Adafruit_BBIO library.
 
+Optionally provide a GPIOBank (python/gpio_bank/gpio_bank.py) so the LED
+toggles are queued and written together with the other pins of its bank.
+set_led() only queues the write; the loop that owns the bank (blink_led()
+here) calls bank.tick() once per iteration.
+
 --------------------------------------------------------------------------
 """
 # ------------------------------------------------------------------------
@@ -52,23 +57,44 @@ USR3_LED = "USR3"
 # ------------------------------------------------------------------------
 # Functions
 # ------------------------------------------------------------------------
-def blink_led():
+def set_led(value, bank=None):
+    """
+    Sets the USR 3 LED, or queues the write on the GPIOBank if one is 
+    provided (written on the owner's next bank.tick())
+    """
+    if bank is None:
+        GPIO.output(USR3_LED, value)
+    else:
+        bank.output(USR3_LED, value)
+
+def blink_led(bank=None):
     """ 
     Blinks the USR 3 LED at 5Hz
     """
     try: 
         # Set up LED
-        GPIO.setup(USR3_LED, GPIO.OUT)
+        if bank is None:
+            GPIO.setup(USR3_LED, GPIO.OUT)
+        else:
+            bank.setup(USR3_LED, GPIO.OUT)
 
         # Simulate blink by setting GPIO.HIGH and GPIO.LOW in turn continuously. 
         # 0.1s intervals for 5Hz
+        value = GPIO.HIGH
         while True:
-            GPIO.output(USR3_LED, GPIO.HIGH)
-            time.sleep(0.1)
-            GPIO.output(USR3_LED, GPIO.LOW)
+            set_led(value, bank)
+            
+            # This loop owns the bank: one flush / snapshot per iteration
+            if bank is not None:
+                bank.tick()
+            
+            value = GPIO.LOW if value == GPIO.HIGH else GPIO.HIGH
             time.sleep(0.1)
 
     except:
+        # Write any queued LED state and release the bank (e.g. /dev/mem)
+        if bank is not None:
+            bank.cleanup()
         GPIO.cleanup()
 
 if __name__ == "__main__":
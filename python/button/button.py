@@ -44,11 +44,17 @@ button is not pressed) and will be connected to power when the button is pressed
   To select the pull up configuration, press_low=True.  To select the pull down
 configuration, press_low=False.
 
+  By default the button reads its pin with Adafruit_BBIO.GPIO.  To share one
+read of the GPIO banks per tick with other buttons / LEDs, provide a GPIOBank
+(see python/gpio_bank/gpio_bank.py).  is_pressed() then reads the bank's last
+snapshot and the owner of the bank calls bank.tick() once per loop.
+
 
 Software API:
 
-  Button(pin, press_low)
+  Button(pin, press_low, sleep_time, bank)
     - Provide pin that the button monitors
+    - Optionally provide a GPIOBank to read the pin from a shared snapshot
     
     wait_for_press()
       - Wait for the button to be pressed 
@@ -109,6 +115,7 @@ LOW           = GPIO.LOW
 class Button():
     """ Button Class """
     pin                           = None
+    bank                          = None
     
     unpressed_value               = None
     pressed_value                 = None
@@ -126,13 +133,16 @@ class Button():
     on_release_callback_value     = None
     
     
-    def __init__(self, pin=None, press_low=True, sleep_time=0.1):
+    def __init__(self, pin=None, press_low=True, sleep_time=0.1, bank=None):
         """ Initialize variables and set up the button """
         if (pin == None):
             raise ValueError("Pin not provided for Button()")
         else:
             self.pin = pin
         
+        # Optional GPIOBank shared with other buttons / LEDs
+        self.bank = bank
+        
         # For pull up resistor configuration:    press_low = True
         # For pull down resistor configuration:  press_low = False
         if press_low:
@@ -155,7 +165,26 @@ class Button():
     def _setup(self):
         """ Setup the hardware components. """
         # Initialize Button
-        GPIO.setup(self.pin, GPIO.IN)
+        if self.bank is None:
+            GPIO.setup(self.pin, GPIO.IN)
+        else:
+            self.bank.setup(self.pin, GPIO.IN)
+
+    # End def
+
+
+    def _read(self, refresh=False):
+        """ Read the pin value.  With a GPIOBank, the value comes from the
+           shared snapshot; refresh=True takes a new snapshot first (used
+           while this button is blocking and nobody else ticks the bank).
+        """
+        if self.bank is None:
+            return GPIO.input(self.pin)
+        
+        if refresh:
+            self.bank.snapshot()
+        
+        return self.bank.input(self.pin)
 
     # End def
 
@@ -166,7 +195,7 @@ class Button():
            Returns:  True  - Button is pressed
                      False - Button is not pressed
         """
-        return GPIO.input(self.pin) == self.pressed_value
+        return self._read() == self.pressed_value
 
     # End def
 
@@ -188,7 +217,7 @@ class Button():
         # Wait for button press
         #   Execute the unpressed callback function based on the sleep time
         #
-        while(GPIO.input(self.pin) == self.unpressed_value):
+        while(self._read(refresh=True) == self.unpressed_value):
         
             if self.unpressed_callback is not None:
                 self.unpressed_callback_value = self.unpressed_callback()
@@ -205,7 +234,7 @@ class Button():
         # Wait for button release
         #   Execute the pressed callback function based on the sleep time
         #
-        while(GPIO.input(self.pin) == self.pressed_value):
+        while(self._read(refresh=True) == self.pressed_value):
         
             if self.pressed_callback is not None:
                 self.pressed_callback_value = self.pressed_callback()
@@ -0,0 +1,11 @@
+"""
+Each driver lives in its own directory and imports its siblings by module
+name, as on the PocketBeagle; put those directories on the path for tests.
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+for name in ("button", "blink_led", "gpio_bank"):
+    sys.path.insert(0, os.path.join(HERE, name))
@@ -0,0 +1,404 @@
+"""
+--------------------------------------------------------------------------
+GPIO Bank Driver
+--------------------------------------------------------------------------
+License:
+Copyright 2021-2024 - Yuka Aoyama
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors
+may be used to endorse or promote products derived from this software without
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+GPIO Bank Driver
+
+  The AM335x on the PocketBeagle groups its GPIO pins into four 32-bit banks.
+Instead of one Adafruit_BBIO.GPIO call (and one sysfs access) per pin, this
+driver reads every bank in one operation per "tick" and keeps the result as a
+snapshot.  Any number of Button / LED users can then read pins from the same
+snapshot, and pin writes are collected and written to the bank in one
+operation when the bank is flushed.
+
+  Pin setup (pin mux and direction) is still done with Adafruit_BBIO.GPIO by
+the memory backend; only the per-tick input / output goes through the bank
+registers.
+
+
+Software API:
+
+  GPIOBank(backend)
+    - Provide the backend that reads / writes whole banks
+
+    setup(pin, direction)
+      - Set up the pin through the backend (GPIO.IN / GPIO.OUT)
+
+    snapshot()
+      - Read all banks in one operation per bank
+
+    input(pin)
+      - Return the value of the pin (HIGH / LOW) from the last snapshot
+      - Function consumes no time
+
+    output(pin, value)
+      - Queue a pin write (HIGH / LOW) until the next flush()
+
+    flush()
+      - Write all queued pin writes, one operation per bank
+
+    tick()
+      - flush() and then snapshot(); call once per main loop iteration
+
+  Backends:
+
+    MemoryBackend()
+      - Memory mapped GPIO registers through /dev/mem (requires root)
+
+    FileBackend(path)
+      - File backed fake of the four banks for testing without hardware
+
+
+"""
+import mmap
+import os
+import struct
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+HIGH          = 1
+LOW           = 0
+
+NUM_BANKS     = 4
+
+# AM335x GPIO module base addresses and register offsets (TRM 25.4)
+BANK_ADDRESS  = (0x44E07000, 0x4804C000, 0x481AC000, 0x481AE000)
+BANK_SIZE     = 0x1000
+
+GPIO_OE           = 0x134
+GPIO_DATAIN       = 0x138
+GPIO_DATAOUT      = 0x13C
+GPIO_CLEARDATAOUT = 0x190
+GPIO_SETDATAOUT   = 0x194
+
+# PocketBeagle header pins / USR LEDs to kernel GPIO number (32 * bank + bit)
+PIN_GPIO = {
+    "USR0"  : 53,  "USR1"  : 54,  "USR2"  : 55,  "USR3"  : 56,
+    "P1_2"  : 87,  "P1_4"  : 89,  "P1_6"  : 5,   "P1_8"  : 2,
+    "P1_10" : 3,   "P1_12" : 4,   "P1_20" : 20,  "P1_26" : 12,
+    "P1_28" : 13,  "P1_29" : 117, "P1_30" : 43,  "P1_31" : 114,
+    "P1_32" : 42,  "P1_33" : 111, "P1_34" : 26,  "P1_35" : 88,
+    "P1_36" : 110,
+    "P2_1"  : 50,  "P2_2"  : 59,  "P2_3"  : 23,  "P2_4"  : 58,
+    "P2_5"  : 30,  "P2_6"  : 57,  "P2_7"  : 31,  "P2_8"  : 60,
+    "P2_9"  : 15,  "P2_10" : 52,  "P2_11" : 14,  "P2_17" : 65,
+    "P2_18" : 47,  "P2_19" : 27,  "P2_20" : 64,  "P2_22" : 46,
+    "P2_24" : 44,  "P2_25" : 41,  "P2_27" : 40,  "P2_28" : 116,
+    "P2_29" : 7,   "P2_30" : 113, "P2_31" : 19,  "P2_32" : 112,
+    "P2_33" : 45,  "P2_34" : 115, "P2_35" : 86,
+}
+
+# ------------------------------------------------------------------------
+# Global variables
+# ------------------------------------------------------------------------
+
+# None
+
+# ------------------------------------------------------------------------
+# Functions / Classes
+# ------------------------------------------------------------------------
+
+def pin_to_bank(pin):
+    """ Return (bank, bit) for a pin name (e.g. "P2_2") or GPIO number """
+    if isinstance(pin, str):
+        if pin not in PIN_GPIO:
+            raise ValueError("Unknown pin {0} for GPIOBank".format(pin))
+        pin = PIN_GPIO[pin]
+
+    return divmod(pin, 32)
+
+# End def
+
+
+class MemoryBackend():
+    """ Memory mapped GPIO bank registers through /dev/mem """
+    fd                            = None
+    banks                         = None
+
+    def __init__(self, device="/dev/mem"):
+        """ Map the register block of every GPIO bank """
+        self.fd    = os.open(device, os.O_RDWR | os.O_SYNC)
+        self.banks = [mmap.mmap(self.fd, BANK_SIZE, offset=address)
+                      for address in BANK_ADDRESS]
+
+    # End def
+
+
+    def setup(self, pin, direction):
+        """ Set up the pin mux / direction with Adafruit_BBIO """
+        import Adafruit_BBIO.GPIO as GPIO
+
+        GPIO.setup(pin, direction)
+
+    # End def
+
+
+    def read_bank(self, bank):
+        """ Return the 32-bit DATAIN register of the bank """
+        return struct.unpack_from("<I", self.banks[bank], GPIO_DATAIN)[0]
+
+    # End def
+
+
+    def write_bank(self, bank, set_mask, clear_mask):
+        """ Set / clear the masked bits of the bank.  The SETDATAOUT and
+            CLEARDATAOUT registers only affect the bits written as 1, so
+            no read-modify-write of DATAOUT is needed.
+        """
+        if set_mask:
+            struct.pack_into("<I", self.banks[bank], GPIO_SETDATAOUT, set_mask)
+        if clear_mask:
+            struct.pack_into("<I", self.banks[bank], GPIO_CLEARDATAOUT, clear_mask)
+
+    # End def
+
+
+    def close(self):
+        """ Unmap the registers """
+        for bank in self.banks:
+            bank.close()
+        os.close(self.fd)
+
+    # End def
+
+# End class
+
+
+class FileBackend():
+    """ File backed fake of the GPIO banks (one little endian 32-bit word
+        per bank) so that Button / LED code can be exercised without
+        hardware.  Tests write pin levels with set_pin().
+    """
+    path                          = None
+
+    def __init__(self, path):
+        """ Create the file with all banks LOW if it does not exist """
+        self.path = path
+
+        if not os.path.exists(path):
+            self._store([0] * NUM_BANKS)
+
+    # End def
+
+
+    def _load(self):
+        """ Return the words of all banks """
+        with open(self.path, "rb") as f:
+            return list(struct.unpack("<{0}I".format(NUM_BANKS), f.read()))
+
+    # End def
+
+
+    def _store(self, words):
+        """ Write the words of all banks """
+        with open(self.path, "wb") as f:
+            f.write(struct.pack("<{0}I".format(NUM_BANKS), *words))
+
+    # End def
+
+
+    def setup(self, pin, direction):
+        """ Nothing to set up for a file """
+        pass
+
+    # End def
+
+
+    def read_bank(self, bank):
+        """ Return the 32-bit word of the bank """
+        return self._load()[bank]
+
+    # End def
+
+
+    def write_bank(self, bank, set_mask, clear_mask):
+        """ Set / clear the masked bits of the bank """
+        words       = self._load()
+        words[bank] = (words[bank] | set_mask) & ~clear_mask & 0xFFFFFFFF
+        self._store(words)
+
+    # End def
+
+
+    def set_pin(self, pin, value):
+        """ Drive a pin from the test side """
+        bank, bit = pin_to_bank(pin)
+
+        if value:
+            self.write_bank(bank, 1 << bit, 0)
+        else:
+            self.write_bank(bank, 0, 1 << bit)
+
+    # End def
+
+
+    def close(self):
+        """ Nothing to do for a file """
+        pass
+
+    # End def
+
+# End class
+
+
+class GPIOBank():
+    """ GPIOBank Class """
+    backend                       = None
+
+    words                         = None
+    set_masks                     = None
+    clear_masks                   = None
+
+
+    def __init__(self, backend=None):
+        """ Initialize variables and the snapshot """
+        if (backend == None):
+            raise ValueError("Backend not provided for GPIOBank()")
+        else:
+            self.backend = backend
+
+        self.words       = None
+        self.set_masks   = [0] * NUM_BANKS
+        self.clear_masks = [0] * NUM_BANKS
+
+    # End def
+
+
+    def setup(self, pin, direction):
+        """ Set up the pin mux / direction through the backend """
+        self.backend.setup(pin, direction)
+
+    # End def
+
+
+    def snapshot(self):
+        """ Read all banks, one backend operation per bank """
+        self.words = [self.backend.read_bank(bank) for bank in range(NUM_BANKS)]
+
+    # End def
+
+
+    def input(self, pin):
+        """ Return the value of the pin from the last snapshot
+
+           Returns:  HIGH / LOW
+        """
+        if self.words is None:
+            self.snapshot()
+
+        bank, bit = pin_to_bank(pin)
+
+        return (self.words[bank] >> bit) & 1
+
+    # End def
+
+
+    def output(self, pin, value):
+        """ Queue a pin write until the next flush() """
+        bank, bit = pin_to_bank(pin)
+        mask      = 1 << bit
+
+        if value:
+            self.set_masks[bank]   |= mask
+            self.clear_masks[bank] &= ~mask
+        else:
+            self.clear_masks[bank] |= mask
+            self.set_masks[bank]   &= ~mask
+
+    # End def
+
+
+    def flush(self):
+        """ Write the queued pin writes, one backend operation per bank """
+        for bank in range(NUM_BANKS):
+            if self.set_masks[bank] or self.clear_masks[bank]:
+                self.backend.write_bank(bank, self.set_masks[bank],
+                                        self.clear_masks[bank])
+                self.set_masks[bank]   = 0
+                self.clear_masks[bank] = 0
+
+    # End def
+
+
+    def tick(self):
+        """ Flush queued writes and take a new snapshot """
+        self.flush()
+        self.snapshot()
+
+    # End def
+
+
+    def cleanup(self):
+        """ Flush queued writes and close the backend """
+        self.flush()
+        self.backend.close()
+
+    # End def
+
+# End class
+
+
+
+# ------------------------------------------------------------------------
+# Main script
+# ------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    import tempfile
+
+    print("GPIO Bank Test")
+
+    # Use the file backed fake so the test runs without hardware
+    path    = os.path.join(tempfile.mkdtemp(), "gpio_banks.bin")
+    backend = FileBackend(path)
+    bank    = GPIOBank(backend)
+
+    backend.set_pin("P2_2", HIGH)
+    bank.tick()
+    print("P2_2 = {0} (expect 1)".format(bank.input("P2_2")))
+
+    bank.output("USR3", HIGH)
+    bank.output("P2_4", HIGH)
+    bank.tick()
+    print("USR3 = {0} (expect 1)".format(bank.input("USR3")))
+    print("P2_4 = {0} (expect 1)".format(bank.input("P2_4")))
+
+    bank.output("USR3", LOW)
+    bank.tick()
+    print("USR3 = {0} (expect 0)".format(bank.input("USR3")))
+
+    bank.cleanup()
+
+    print("Test Complete")
+
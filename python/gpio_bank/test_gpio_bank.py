@@ -0,0 +1,51 @@
+"""
+Tests for the GPIO bank snapshot backend, against the file backed fake.
+"""
+from gpio_bank import FileBackend, GPIOBank, HIGH, LOW
+from button import Button
+from blink_USR3 import set_led, USR3_LED
+
+
+def make_bank(tmp_path):
+    backend = FileBackend(str(tmp_path / "gpio_banks.bin"))
+    return backend, GPIOBank(backend)
+
+# End def
+
+
+def test_button_reads_shared_snapshot(tmp_path):
+    backend, bank = make_bank(tmp_path)
+    pull_up   = Button("P2_2", press_low=True, bank=bank)
+    pull_down = Button("P2_4", press_low=False, bank=bank)
+
+    bank.tick()
+    assert pull_up.is_pressed()
+    assert not pull_down.is_pressed()
+
+    backend.set_pin("P2_2", HIGH)
+    backend.set_pin("P2_4", HIGH)
+
+    # Nothing changes until the owner of the bank takes a new snapshot
+    assert pull_up.is_pressed()
+    bank.tick()
+    assert not pull_up.is_pressed()
+    assert pull_down.is_pressed()
+
+# End def
+
+
+def test_set_led_is_written_on_tick(tmp_path):
+    backend, bank = make_bank(tmp_path)
+
+    set_led(HIGH, bank)
+    assert backend.read_bank(1) == 0
+
+    bank.tick()
+    assert bank.input(USR3_LED) == HIGH
+    assert backend.read_bank(1) == 1 << 24
+
+    set_led(LOW, bank)
+    bank.cleanup()
+    assert backend.read_bank(1) == 0
+
+# End def